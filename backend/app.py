@@ -1,14 +1,20 @@
 # backend/app.py
 from fastapi import FastAPI, Body, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 import uvicorn
 from typing import Dict, Any
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache, partial
+import asyncio
+import json
 import tiktoken
 import logging
 
-from baseLLM import create_chat_completion
-from dbManager import DatabaseManager
+# The API shares baseLLM's database manager, so both use one connection pool
+from baseLLM import create_chat_completion, stream_chat_completion, db_manager
+from dbManager import AsyncDatabaseManager
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -25,15 +31,29 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Initialize database manager
-db_manager = DatabaseManager()
+# Database access from the handlers: one writer thread for ingest, reader threads for queries
+async_db_manager = AsyncDatabaseManager(db_manager)
 
-# In-memory storage for parsed data
-parsed_data_store = {}
+# Chat turns read and append to baseLLM's shared conversation history, so they run one at a
+# time on a single thread, like the database writes
+chat_executor = ThreadPoolExecutor(max_workers=1)
+
+async def run_chat(fn, *args):
+    """Run a blocking chat operation on the chat thread"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(chat_executor, partial(fn, *args))
 
 # Track sessions to detect new uploads
 session_counters = {}
 
+# Bumped whenever tables are created, replaced or dropped; keys the cached database summary
+schema_version = 0
+
+def invalidate_database_summary():
+    """Make the next summary request rebuild from the database"""
+    global schema_version
+    schema_version += 1
+
 # Pydantic models for request/response
 class ChatMessage(BaseModel):
     message: str
@@ -43,23 +63,30 @@ class ChatResponse(BaseModel):
     response: str
     status: str
 
+@app.on_event("shutdown")
+def close_database():
+    """Close the pooled database connections when the server stops"""
+    chat_executor.shutdown()
+    async_db_manager.close()
+
 @app.post("/api/parsed-data")
 async def receive_parsed_data(data: Dict[str, Any] = Body(...)):
     """Endpoint to receive parsed flight data from JS frontend"""
     logger.info("Received request to /api/parsed-data")
-    logger.info(f"Request data keys: {data.keys()}")
+    logger.info("Request data keys: %s", data.keys())
 
     session_id = data.get("sessionId", "default")
     message_type = data.get("messageType", "unknown")
     message_list = data.get("messageList", {})
+    field_types = data.get("fieldTypes")  # Optional MAVLink type per field, e.g. "uint8_t"
     is_new_upload = data.get("isNewUpload", False)  # Flag from frontend for new file uploads
 
     # Log the message type
-    logger.info(f"Message Type: {message_type}")
-    if "messageList" in data:
-        logger.info("Keys under 'messageList':")
+    logger.info("Message Type: %s", message_type)
+    if "messageList" in data and logger.isEnabledFor(logging.DEBUG):
+        logger.debug("Keys under 'messageList':")
         for key in message_list.keys():
-            logger.info(f"- {key}")
+            logger.debug("- %s", key)
 
     try:
         # Check if this is a new session or new upload
@@ -72,30 +99,26 @@ async def receive_parsed_data(data: Dict[str, Any] = Body(...)):
         # Clear all tables on new upload or first message of new session
         if is_new_upload or is_first_message:
             logger.info("Clearing all existing tables for new upload")
-            db_manager.clear_all_tables()
-            # Clear in-memory store as well
-            parsed_data_store.clear()
+            await async_db_manager.clear_all_tables()
             session_counters[session_id] = 0
         
         session_counters[session_id] += 1
         
         # Create table for this message type (will replace if needed)
-        table_name = db_manager.create_table_for_message_type(message_type, message_list, replace_existing=True)
+        table_name = await async_db_manager.create_table_for_message_type(
+            message_type, message_list, replace_existing=True, field_types=field_types
+        )
         
         # Insert data into the table
-        db_manager.insert_data_into_table(table_name, message_list)
-        
-        # Also store in memory for backward compatibility
-        if session_id not in parsed_data_store:
-            parsed_data_store[session_id] = {"data": {}}
-        
-        parsed_data_store[session_id]["data"][message_type] = message_list
+        await async_db_manager.insert_data_into_table(table_name, message_list)
         
-        logger.info(f"Successfully processed data for message type: {message_type}")
+        logger.info("Successfully processed data for message type: %s", message_type)
         
     except Exception as e:
-        logger.error(f"Error processing data: {str(e)}")
+        logger.error("Error processing data: %s", e)
         return {"status": "error", "message": f"Failed to process data: {str(e)}"}
+    finally:
+        invalidate_database_summary()
 
     return {"status": "success", "message": "Data received and stored", "session_id": session_id, "table_name": table_name}
 
@@ -104,55 +127,54 @@ async def receive_parsed_data(data: Dict[str, Any] = Body(...)):
 async def get_tables():
     """Endpoint to list all tables in the database"""
     try:
-        tables = db_manager.get_all_tables()
+        tables = await async_db_manager.get_all_tables()
         return {"status": "success", "tables": tables}
     except Exception as e:
-        logger.error(f"Error getting tables: {str(e)}")
+        logger.error("Error getting tables: %s", e)
         return {"status": "error", "message": str(e)}
 
 @app.get("/api/table/{table_name}")
 async def get_table_data(table_name: str, limit: int = 100):
     """Endpoint to retrieve data from a specific table"""
+    if not async_db_manager.table_exists(table_name):
+        raise HTTPException(status_code=404, detail=f"Table not found: {table_name}")
     try:
-        columns, data = db_manager.get_table_data(table_name, limit)
+        columns, rows = await async_db_manager.get_table_data(table_name, limit)
+        data = [dict(zip(columns, row)) for row in rows]
         return {"status": "success", "table": table_name, "data": data, "count": len(data)}
     except Exception as e:
-        logger.error(f"Error getting table data: {str(e)}")
+        logger.error("Error getting table data: %s", e)
         return {"status": "error", "message": str(e)}
 
 @app.delete("/api/clear-database")
 async def clear_database():
     """Endpoint to manually clear all data from the database"""
     try:
-        db_manager.clear_all_tables()
-        parsed_data_store.clear()
+        await async_db_manager.clear_all_tables()
+        invalidate_database_summary()
         session_counters.clear()
         return {"status": "success", "message": "Database cleared successfully"}
     except Exception as e:
-        logger.error(f"Error clearing database: {str(e)}")
+        logger.error("Error clearing database: %s", e)
         return {"status": "error", "message": str(e)}
 
+@lru_cache(maxsize=1)
+def cached_database_summary(version: int) -> Dict[str, Any]:
+    """Summary of every table, built once per schema version (blocking)"""
+    return {"tables": db_manager.get_database_summary()}
+
+def build_database_summary() -> Dict[str, Any]:
+    """Collect name, row count and schema for every table (blocking)"""
+    return cached_database_summary(schema_version)
+
 @app.get("/api/database-summary")
 async def get_database_summary():
     """Endpoint to get a summary of the database structure"""
     try:
-        tables = db_manager.get_all_tables()
-        summary = {"tables": []}
-        
-        for table_name in tables:
-            schema = db_manager.get_table_schema(table_name)
-            row_count = db_manager.get_table_row_count(table_name)
-            
-            table_info = {
-                "name": table_name,
-                "row_count": row_count,
-                "columns": schema
-            }
-            summary["tables"].append(table_info)
-        
+        summary = await async_db_manager.run_read(build_database_summary)
         return {"status": "success", "summary": summary}
     except Exception as e:
-        logger.error(f"Error getting database summary: {str(e)}")
+        logger.error("Error getting database summary: %s", e)
         return {"status": "error", "message": str(e)}
 
 @app.get("/")
@@ -166,58 +188,85 @@ if __name__ == "__main__":
 async def chat_with_llm(chat_request: ChatMessage):
     """Endpoint to chat with the LLM about flight data"""
     try:
-        logger.info(f"Received chat message: {chat_request.message}")
+        logger.info("Received chat message: %s", chat_request.message)
         
 
 
-        response = create_chat_completion(chat_request.message)
+        response = await run_chat(create_chat_completion, chat_request.message)
         
         logger.info("Successfully generated LLM response")
         return ChatResponse(response=response, status="success")
         
     except Exception as e:
-        logger.error(f"Error in chat endpoint: {str(e)}")
+        logger.error("Error in chat endpoint: %s", e)
         raise HTTPException(status_code=500, detail=f"Chat error: {str(e)}")
 
 
+@app.post("/api/chat/stream")
+async def stream_chat_with_llm(chat_request: ChatMessage):
+    """Endpoint to chat with the LLM, streaming the answer as server-sent events"""
+    logger.info("Received streaming chat message: %s", chat_request.message)
+
+    async def events():
+        # The turn runs on the chat thread and hands each chunk to the event loop as it arrives
+        loop = asyncio.get_running_loop()
+        chunks = asyncio.Queue()
+
+        def run_turn():
+            try:
+                for chunk in stream_chat_completion(chat_request.message):
+                    loop.call_soon_threadsafe(chunks.put_nowait, chunk)
+            finally:
+                loop.call_soon_threadsafe(chunks.put_nowait, None)
+
+        turn = loop.run_in_executor(chat_executor, run_turn)
+        while True:
+            chunk = await chunks.get()
+            if chunk is None:
+                break
+            yield f"data: {json.dumps({'content': chunk})}\n\n"
+        await turn
+        yield "event: done\ndata: {}\n\n"
+
+    return StreamingResponse(events(), media_type="text/event-stream")
+
+
 @app.post("/api/chat/clear")
 async def clear_chat_history():
     """Endpoint to clear chat history"""
     try:
-        # Import and clear the messages list from baseLLM
+        # Import and clear the messages list from baseLLM, between chat turns
         from baseLLM import messages
-        messages.clear()
+        await run_chat(messages.clear)
         
         return {"status": "success", "message": "Chat history cleared"}
     except Exception as e:
-        logger.error(f"Error clearing chat history: {str(e)}")
+        logger.error("Error clearing chat history: %s", e)
         return {"status": "error", "message": str(e)}
 
+def build_chat_context() -> Dict[str, Any]:
+    """Collect the table names, row counts and column names offered to the chat (blocking)"""
+    tables = build_database_summary()["tables"]
+    return {
+        "available_tables": [table["name"] for table in tables],
+        "table_summaries": [
+            {
+                "name": table["name"],
+                "row_count": table["row_count"],
+                "columns": [col["name"] for col in table["columns"]]
+            }
+            for table in tables
+        ]
+    }
+
 @app.get("/api/chat/context")
 async def get_chat_context():
     """Endpoint to get current database context for chat"""
     try:
-        tables = db_manager.get_all_tables()
-        context = {
-            "available_tables": tables,
-            "table_summaries": []
-        }
-        
-        for table_name in tables:
-            try:
-                row_count = db_manager.get_table_row_count(table_name)
-                schema = db_manager.get_table_schema(table_name)
-                context["table_summaries"].append({
-                    "name": table_name,
-                    "row_count": row_count,
-                    "columns": [col["name"] for col in schema]
-                })
-            except Exception as e:
-                logger.warning(f"Could not get info for table {table_name}: {e}")
-        
+        context = await async_db_manager.run_read(build_chat_context)
         return {"status": "success", "context": context}
     except Exception as e:
-        logger.error(f"Error getting chat context: {str(e)}")
+        logger.error("Error getting chat context: %s", e)
         return {"status": "error", "message": str(e)}
 
 
@@ -1,6 +1,7 @@
 import os
 import logging
 import re  # Import the regular expression module
+from functools import lru_cache
 from openai import OpenAI
 from dotenv import load_dotenv
 import tiktoken
@@ -47,170 +48,314 @@ analyst_hints = """
             * Avoid binary judgments unless clearly supported by the data; instead, describe patterns or suggest likely causes.
             """
 
-# Global conversation history
+# Bare SELECT statements in a response that is missing the "query database:" prefix
+SQL_QUERY_PATTERN = re.compile(r"(SELECT\s[\s\S]*?FROM\s[\s\S]*?;)", re.IGNORECASE)
+
+# Text that can make handle_response treat a response as a database or analysis step; while
+# streaming, nothing from the first match onwards is sent until the response is complete
+TOOL_MARKERS = ("select", "query database:", "analyse:")
+TOOL_MARKER_PATTERN = re.compile("|".join(map(re.escape, TOOL_MARKERS)), re.IGNORECASE)
+
+# Global conversation history, stored as {"role", "content", "tokens"} messages; the token
+# count is taken once when a message is added and is not sent to the API
 messages = []
 
+# Token budget for the conversation history sent with each completion request
+MAX_HISTORY_TOKENS = 6000
+
+# Token cap for database results quoted back to the LLM. They are added to the history twice
+# (as results and in the analysis prompt), so both copies fit within MAX_HISTORY_TOKENS
+MAX_RESULT_TOKENS = 2000
+
+# Upper bound on query/analysis round-trips made for a single user message
+MAX_TOOL_STEPS = 10
+
+@lru_cache(maxsize=1)
+def get_encoder():
+    """Load the tokenizer for the chat model once"""
+    try:
+        return tiktoken.encoding_for_model("gpt-4o-mini")
+    except KeyError:
+        # Older tiktoken releases don't know the model name
+        return tiktoken.get_encoding("cl100k_base")
+
+def count_tokens(content):
+    """Count the tokens in a message"""
+    # Special-token text such as "<|endoftext|>" in user input or data is counted as plain text
+    return len(get_encoder().encode(content, disallowed_special=()))
+
+def truncate_tokens(content, max_tokens):
+    """Cut content down to max_tokens tokens, noting how much was left out"""
+    tokens = get_encoder().encode(content, disallowed_special=())
+    if len(tokens) <= max_tokens:
+        return content
+    return f"{get_encoder().decode(tokens[:max_tokens])} ... [truncated, {len(tokens) - max_tokens} more tokens]"
+
+def add_message(role, content):
+    """Record a message in the conversation history together with its token count"""
+    messages.append({"role": role, "content": content, "tokens": count_tokens(content)})
+
 def get_prompt(input_message):
-    """Build conversation context with proper role alternation"""
-    context = []
-    
-    # Add the new user message
-    messages.append(input_message)
-    
-    # Build context with proper role alternation
-    for index, message in enumerate(messages):
-        if index % 2 == 0:
-            context.append({"role": "user", "content": message})
-        else:
-            context.append({"role": "assistant", "content": message})
-    
-    return context
+    """Record the new user message and return the newest messages that fit the token budget"""
+    add_message("user", input_message)
 
-def create_chat_completion(input_message):
-    """Create a chat completion using the OpenAI API and interact with the database recursively in steps."""
+    # Walk back from the newest message; the new user message is always sent
+    window_start = len(messages) - 1
+    used_tokens = messages[-1]["tokens"]
+    while window_start > 0:
+        message_tokens = messages[window_start - 1]["tokens"]
+        if used_tokens + message_tokens > MAX_HISTORY_TOKENS:
+            break
+        used_tokens += message_tokens
+        window_start -= 1
+
+    return [{"role": message["role"], "content": message["content"]} for message in messages[window_start:]]
+
+def add_assistant_message(content):
+    """Record an assistant turn in the conversation history"""
+    add_message("assistant", content)
+
+# Define system instructions for the LLM
+system_instructions = (
+    "You are an flight engineer assistant capable of interacting with a SQLite database containing flight data about a singular flight. "
+    "Very important: If you need to query the database, you MUST respond with: 'query database: [SQL_QUERY]' or 'analyse: [PROMPT] [DATA_TO_ANALYZE]'."
+    "never query the every row in a table"
+    "assume user does not know the table names, column names, or data types. you must query the database using pragma table info to find out."
+    "You either generate a SQL query, request analysis, or ask clarifying questions/respond to user. Never combine these in one response. "
+    "You should break down complex questions into steps and validate each step with the user before proceeding. "
+    "If the query is ambiguous or fails, ask clarifying questions before generating the SQL query."
+    "When referring to table or column names in SQL queries, use double quotes (\") or no quotes at all. Never use backticks (`)."
+)
+
+def build_conversation(input_message):
+    """Record the user message and return the messages to send, system instructions first"""
+    conversation_messages = [{"role": "system", "content": system_instructions}]
+    conversation_messages.extend(get_prompt(input_message))
+    return conversation_messages
+
+def stream_completion(conversation_messages):
+    """Request a streamed completion from the OpenAI API and yield its content as it arrives"""
+    stream = client.chat.completions.create(
+        model="gpt-4o-mini",
+        messages=conversation_messages,
+        max_tokens=1000,
+        temperature=0.1,
+        stream=True
+    )
     try:
-        # Define system instructions for the LLM
-        system_instructions = (
-            "You are an flight engineer assistant capable of interacting with a SQLite database containing flight data about a singular flight. "
-            "Very important: If you need to query the database, you MUST respond with: 'query database: [SQL_QUERY]' or 'analyse: [PROMPT] [DATA_TO_ANALYZE]'."
-            "never query the every row in a table"
-            "assume user does not know the table names, column names, or data types. you must query the database using pragma table info to find out."
-            "You either generate a SQL query, request analysis, or ask clarifying questions/respond to user. Never combine these in one response. "
-            "You should break down complex questions into steps and validate each step with the user before proceeding. "
-            "If the query is ambiguous or fails, ask clarifying questions before generating the SQL query."
-            "When referring to table or column names in SQL queries, use double quotes (\") or no quotes at all. Never use backticks (`)."
-        )
-
-        # Get conversation context
-        conversation_messages = get_prompt(input_message)
-        
-        # Add system instructions to the conversation context
-        conversation_messages.insert(0, {"role": "system", "content": system_instructions})
-        
-        # Create completion using OpenAI API
-        completion = client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=conversation_messages,
-            max_tokens=1000,
-            temperature=0.1
-        )
-        
-        # Validate the API response structure
-        if not completion or not completion.choices or len(completion.choices) == 0:
-            logger.error("OpenAI API response is malformed or empty.")
-            return "The OpenAI API response is malformed or empty. Please try again later."
-
-        # Extract response content
-        response_content = completion.choices[0].message.content
-        logger.info(f"OpenAI API response: {response_content}")
+        for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+    finally:
+        # Closing the generator early also drops the HTTP stream, so the rest isn't generated
+        stream.close()
+
+def query_end(response_content):
+    """Length of a "query database:" response once its SQL statement is complete, else None.
+
+    The statement ends at the first ';' outside quotes; anything the LLM would add after it is
+    not needed to run the query, so the rest of the stream can be cancelled.
+    """
+    head = response_content.lstrip()
+    if not head.lower().startswith("query database:"):
+        return None
+    end = head.find(";")
+    while end != -1:
+        if head.count("'", 0, end) % 2 == 0 and head.count('"', 0, end) % 2 == 0:
+            return len(response_content) - len(head) + end + 1
+        end = head.find(";", end + 1)
+    return None
+
+def read_completion(conversation_messages):
+    """Read a complete LLM response, stopping early once a requested database query is complete"""
+    response_content = ""
+    deltas = stream_completion(conversation_messages)
+    for delta in deltas:
+        response_content += delta
+        end = query_end(response_content)
+        if end is not None:
+            deltas.close()
+            return response_content[:end]
+    return response_content
+
+def streamable_length(response_content):
+    """How much of a partial response can be shown to the user, and whether a tool marker was hit.
+
+    Everything before the first TOOL_MARKERS match is safe. Without a match, a trailing partial
+    marker such as "sel" is held back until the next delta shows what it becomes.
+    """
+    marker = TOOL_MARKER_PATTERN.search(response_content)
+    if marker:
+        return marker.start(), True
+    for held in range(min(len(response_content), max(map(len, TOOL_MARKERS)) - 1), 0, -1):
+        tail = response_content[-held:].lower()
+        if any(marker.startswith(tail) for marker in TOOL_MARKERS):
+            return len(response_content) - held, False
+    return len(response_content), False
+
+def record_answer(response_content, analyst_requested):
+    """Add the final answer of a chat turn to the conversation history"""
+    if analyst_requested:
+        add_assistant_message(f"Flight analyst response: {response_content}")
+    else:
+        add_assistant_message(response_content)
+
+def handle_response(response_content, analyst_requested):
+    """Act on one complete LLM response.
+
+    Returns (next_input, reply, analyst_requested). next_input is the follow-up prompt when the
+    response asked for a database query or analysis step; otherwise reply is the text for the user.
+    """
+    logger.info("OpenAI API response: %s", response_content)
+
+    # Check if the response requires database interaction
+    response_lower = response_content.lower()
+    if "query database:" not in response_lower and "analyse:" not in response_lower:
+        # Try to detect SQL query and add the prefix; plain answers skip the regex entirely
+        sql_match = None
+        if "select" in response_lower and ";" in response_content:
+            sql_match = SQL_QUERY_PATTERN.search(response_content)
+        if sql_match:
+            sql_query = sql_match.group(1)
+            response_content = f"query database: {sql_query}"
+            logger.info("Detected SQL query and added prefix: %s", response_content)
+
+    if "query database:" in response_content.lower():
+        # Extract SQL query from the response
+        sql_query = response_content.split("query database:")[1].strip()
+
         try:
-            response_content = completion.choices[0].message.content
-        except IndexError:
-            logger.error("OpenAI API response 'choices' list is empty.")
-            clarifying_question = "The OpenAI API response was missing expected content. Retrying the request."
-            messages.append(clarifying_question)
-            
-            # Retry mechanism with a limit
-            max_retries = 3
-            for attempt in range(max_retries):
-                logger.info(f"Attempt {attempt + 1}/{max_retries}: Retrying API call...")
-                completion = client.chat.completions.create(
-                    model="gpt-4o-mini",
-                    messages=conversation_messages,
-                    max_tokens=1000,
-                    temperature=0.1
-                )
-                if completion and completion.choices and len(completion.choices) > 0:
-                    response_content = completion.choices[0].message.content
-                    logger.info(f"Retry successful. Response content: {response_content}")
-                    break  # Exit the retry loop if successful
-                else:
-                    logger.warning(f"Attempt {attempt + 1}/{max_retries}: API response is still malformed.")
-            else:  # This else belongs to the for loop
-                error_message = "The OpenAI API consistently returned malformed responses. Please check the API and try again later."
-                logger.error(error_message)
-                return error_message
-        # Check if the response requires database interaction
-        if "query database:" not in response_content.lower() and "analyse:" not in response_content.lower():
-            # Try to detect SQL query and add the prefix
-            sql_match = re.search(r"(SELECT\s[\s\S]*?FROM\s[\s\S]*?;)", response_content, re.IGNORECASE)
-            if sql_match:
-                sql_query = sql_match.group(1)
-                response_content = f"query database: {sql_query}"
-                logger.info(f"Detected SQL query and added prefix: {response_content}")
-        
-        if "query database:" in response_content.lower():
-            # Extract SQL query from the response
-            sql_query = response_content.split("query database:")[1].strip()
-            
-            try:
-                # Validate and sanitize the query
-                if ";" in sql_query and sql_query.count(";") > 1:
-                    return "The query contains multiple statements. Please provide a single SQL statement."
-                
-                # Use DatabaseManager to execute the query
-                db_results = db_manager.execute_query(sql_query)
-
-                if not db_results:
-                    clarifying_question = (
-                        f"The query returned no results. Can you confirm the structure of the table "
-                        f"or provide additional details about the data you are looking for?"
-                    )
-                    messages.append(clarifying_question)
-                    
-                    # Recursive call to proceed
-                    analysis_prompt = f"The query returned no results. Re-evaluate the query or try a different approach."
-                    return create_chat_completion(analysis_prompt)
-                
-                # Add database results to the conversation history
-                messages.append(f"Database results: {db_results}")
-                analysis_prompt = f"Analyze these database results and provide an answer to the user's original question: {db_results}"
-                return create_chat_completion(analysis_prompt)
-            
-            except Exception as e:
-                logger.error(messages[-1])
-                
-                # Ask clarifying questions
-                clarifying_question = (
-                    f"Can you clarify the structure of the table or provide additional details about the columns? The error was: {str(e)}"
-                )
-                
-                # Add clarifying question to conversation history
-                messages.append(clarifying_question)
-                return clarifying_question
-        
-        if "analyse:" in response_content.lower():
-            parts = response_content.split("analyse:")
-            if len(parts) < 2:
-                return "Invalid 'analyse:' format.  It should be 'analyse: [PROMPT] [DATA]'."
-
-            prompt_and_data = parts[1].strip()
-            
-            # Further split the prompt and data
-            split_index = prompt_and_data.find(' ')  # Find the first space to separate prompt and data
-            if split_index == -1:
-                return "Invalid 'analyse:' format.  It should be 'analyse: [PROMPT] [DATA]'."
-            
-            analyst_prompt = prompt_and_data[:split_index].strip()
-            data_to_analyze = prompt_and_data[split_index:].strip()
-            
-            # Invoke the flight analyst agent
-            flight_analyst_input = f"hints:{analyst_hints}.\n {analyst_prompt}\nData:\n{data_to_analyze}"
-            analyst_response = create_chat_completion(flight_analyst_input)
-            
-            # Add the analyst's response to the conversation history
-            messages.append(f"Flight analyst response: {analyst_response}")
-            return analyst_response
-            
-        # Add response to conversation history
-        messages.append(response_content)
-        
-        return response_content
-        
+            # Use DatabaseManager to execute the query; multiple statements are rejected there
+            db_results = db_manager.execute_query(sql_query)
+        except Exception as e:
+            logger.error("Database query failed: %s", e)
+
+            # Ask clarifying questions
+            clarifying_question = (
+                f"Can you clarify the structure of the table or provide additional details about the columns? The error was: {str(e)}"
+            )
+
+            # Add clarifying question to conversation history
+            add_assistant_message(clarifying_question)
+            return None, clarifying_question, analyst_requested
+
+        if not db_results:
+            add_assistant_message(
+                "The query returned no results. Can you confirm the structure of the table "
+                "or provide additional details about the data you are looking for?"
+            )
+
+            # Let the LLM re-evaluate on the next step
+            return "The query returned no results. Re-evaluate the query or try a different approach.", None, analyst_requested
+
+        # Add database results to the conversation history and ask for the analysis next; large
+        # results are truncated so they can't push the prompt past the token budget
+        results_text = truncate_tokens(str(db_results), MAX_RESULT_TOKENS)
+        add_assistant_message(f"Database results: {results_text}")
+        return f"Analyze these database results and provide an answer to the user's original question: {results_text}", None, analyst_requested
+
+    if "analyse:" in response_content.lower():
+        parts = response_content.split("analyse:")
+        if len(parts) < 2:
+            return None, "Invalid 'analyse:' format.  It should be 'analyse: [PROMPT] [DATA]'.", analyst_requested
+
+        prompt_and_data = parts[1].strip()
+
+        # Further split the prompt and data
+        split_index = prompt_and_data.find(' ')  # Find the first space to separate prompt and data
+        if split_index == -1:
+            return None, "Invalid 'analyse:' format.  It should be 'analyse: [PROMPT] [DATA]'.", analyst_requested
+
+        analyst_prompt = prompt_and_data[:split_index].strip()
+        data_to_analyze = prompt_and_data[split_index:].strip()
+
+        # Hand the data to the flight analyst on the next step
+        return f"hints:{analyst_hints}.\n {analyst_prompt}\nData:\n{data_to_analyze}", None, True
+
+    # Add response to conversation history
+    record_answer(response_content, analyst_requested)
+    return None, response_content, analyst_requested
+
+def too_many_steps():
+    """Record and return the reply used when a chat turn exceeds MAX_TOOL_STEPS"""
+    error_message = "The assistant needed too many database steps to answer. Please try a more specific question."
+    logger.error(error_message)
+    add_assistant_message(error_message)
+    return error_message
+
+def create_chat_completion(input_message):
+    """Create a chat completion using the OpenAI API, querying the database and running analysis steps until the LLM answers."""
+    try:
+        analyst_requested = False
+
+        for _ in range(MAX_TOOL_STEPS):
+            response_content = read_completion(build_conversation(input_message))
+
+            # Validate the API response
+            if not response_content:
+                logger.error("OpenAI API response is malformed or empty.")
+                return "The OpenAI API response is malformed or empty. Please try again later."
+
+            input_message, reply, analyst_requested = handle_response(response_content, analyst_requested)
+            if input_message is None:
+                return reply
+
+        return too_many_steps()
+
     except Exception as e:
-        logger.error(f"Error creating chat completion: {str(e)}")
+        logger.error("Error creating chat completion: %s", e)
         return f"OpenAI API error: {str(e)}"
 
+def stream_chat_completion(input_message):
+    """Like create_chat_completion, but yield the final answer as the LLM generates it.
+
+    Each response is streamed up to the first TOOL_MARKERS match. From there on it is held back
+    until the response is complete and handle_response has run on the full text, exactly as in
+    create_chat_completion, so a response that turns out to be a database or analysis step
+    (including a bare SELECT without the "query database:" prefix) never reaches the client.
+    Only text written before such a marker, e.g. "Let me check: ", may already have been sent.
+    """
+    try:
+        analyst_requested = False
+
+        for _ in range(MAX_TOOL_STEPS):
+            deltas = stream_completion(build_conversation(input_message))
+            response_content = ""
+            sent = 0
+            withheld = False
+            for delta in deltas:
+                response_content += delta
+                end = query_end(response_content)
+                if end is not None:
+                    deltas.close()
+                    response_content = response_content[:end]
+                    break
+                if not withheld:
+                    safe, withheld = streamable_length(response_content)
+                    if safe > sent:
+                        yield response_content[sent:safe]
+                        sent = safe
+
+            # Validate the API response
+            if not response_content:
+                logger.error("OpenAI API response is malformed or empty.")
+                yield "The OpenAI API response is malformed or empty. Please try again later."
+                return
+
+            input_message, reply, analyst_requested = handle_response(response_content, analyst_requested)
+            if input_message is None:
+                # A plain answer only needs its held-back remainder; any other reply is new text
+                remainder = response_content[sent:] if reply == response_content else reply
+                if remainder:
+                    yield remainder
+                return
+
+        yield too_many_steps()
+
+    except Exception as e:
+        logger.error("Error creating chat completion: %s", e)
+        yield f"OpenAI API error: {str(e)}"
+
 
 def clear_conversation():
     """Clear the conversation history"""
@@ -223,8 +368,4 @@ def get_conversation_history():
 
 def get_conversation_context():
     """Get formatted conversation context for debugging"""
-    context = []
-    for index, message in enumerate(messages):
-        role = "user" if index % 2 == 0 else "assistant"
-        context.append({"role": role, "content": message})
-    return context
\ No newline at end of file
+    return [dict(message) for message in messages]
\ No newline at end of file
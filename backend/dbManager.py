@@ -1,37 +1,171 @@
 import sqlite3
 import os
+import asyncio
 import logging
-from typing import Dict, Any, List, Tuple
+import queue
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from itertools import chain, islice, repeat
+from pathlib import Path
+from typing import Dict, Any, Callable, Iterable, List, Optional, Tuple
 from contextlib import contextmanager
+from functools import lru_cache, partial
 
 logger = logging.getLogger(__name__)
 
+# Database file location. The data is re-uploaded for every log, so it lives in the local temp
+# directory by default; point UAV_DB_PATH elsewhere (e.g. /dev/shm on Linux) to override
+DEFAULT_DB_PATH = os.environ.get("UAV_DB_PATH") or os.path.join(tempfile.gettempdir(), "uav_logs.db")
+
+# Per-connection tuning. journal_mode=WAL is persistent, so it is set once in __init__
+CONNECTION_PRAGMAS = """
+PRAGMA synchronous=NORMAL;
+PRAGMA temp_store=MEMORY;
+PRAGMA cache_size=-65536;
+PRAGMA mmap_size=268435456;
+PRAGMA busy_timeout=5000;
+"""
+
+# Number of long-lived read-only connections kept open per DatabaseManager
+POOL_SIZE = int(os.environ.get("UAV_DB_POOL_SIZE", 8))
+
+# Read-write connections; writes are funnelled through one writer thread, so few are needed
+WRITER_POOL_SIZE = 2
+
+# Rows bound into one multi-row INSERT statement while ingesting
+MAX_ROWS_PER_INSERT = 500
+
+# Bound parameters allowed per statement by SQLite builds older than 3.32; used when the
+# connection can't report its own limit (Connection.getlimit needs Python 3.11)
+MAX_VARIABLES_PER_STATEMENT = 999
+
+# Prepared statements kept per connection by the sqlite3 module
+STATEMENT_CACHE_SIZE = 256
+
+
+@lru_cache(maxsize=256)
+def _compile_insert(table_name: str, field_names: Tuple[str, ...], row_count: int = 1) -> str:
+    """Build the (multi-row) INSERT statement for a table once per (table, fields, rows) shape"""
+    placeholders = '(' + ', '.join(['?' for _ in field_names]) + ')'
+    field_names_quoted = ', '.join([f'"{field}"' for field in field_names])
+    values = ', '.join([placeholders] * row_count)
+    return f'INSERT INTO "{table_name}" ({field_names_quoted}) VALUES {values}'
+
+
+@lru_cache(maxsize=256)
+def _select_sql(table_name: str) -> str:
+    """Build the paged SELECT for a table once, so the statement cache sees the same SQL text"""
+    return f'SELECT * FROM "{table_name}" LIMIT ?'
+
+
+def _column_affinity(field_type: Optional[str]) -> str:
+    """SQLite column type for a MAVLink field type such as 'uint8_t', 'char[16]' or 'float'"""
+    if field_type:
+        field_type = field_type.lower()
+        if field_type.startswith('char'):
+            return 'TEXT'
+        if 'int' in field_type and '[' not in field_type:
+            return 'INTEGER'
+    # float/double, arrays and unknown types keep the original REAL columns
+    return 'REAL'
+
+
+@lru_cache(maxsize=4096)
+def _column_definition(field: str, affinity: str = 'REAL') -> str:
+    """Column definition for a message field; the same field names recur across uploads"""
+    return f'"{field}" {affinity}'
+
+
+# Maps every ASCII character other than letters, digits and '_' to '_'
+TABLE_NAME_TRANSLATION = str.maketrans(
+    {c: '_' for c in map(chr, range(128)) if not (c.isalnum() or c == '_')}
+)
+
+
 class DatabaseManager:
     """Database manager for UAV log data"""
     
     def __init__(self, db_path: str = None):
         if db_path is None:
-            self.db_path = os.path.join(os.getenv('APPDATA'), 'uav_logs.db')
+            self.db_path = DEFAULT_DB_PATH
         else:
             self.db_path = db_path
+        self._enable_wal()
+        # Column names and types of the tables created through this manager, so repeat uploads skip the DDL
+        self._created_tables: Dict[str, Tuple[Tuple[str, str], ...]] = {}
+        # Row counts maintained on insert, so counting doesn't need a full table scan
+        self._row_counts: Dict[str, int] = {}
+        # Batch insert functions specialised per (table, fields), built on first insert
+        self._insert_fns: Dict[Tuple[str, Tuple[str, ...]], Callable[[sqlite3.Cursor, Iterable[Tuple]], None]] = {}
+        self._pool = queue.Queue(maxsize=WRITER_POOL_SIZE)
+        for _ in range(WRITER_POOL_SIZE):
+            self._pool.put(self._open_connection())
+        self._read_pool = queue.Queue(maxsize=POOL_SIZE)
+        for _ in range(POOL_SIZE):
+            self._read_pool.put(self._open_connection(read_only=True))
+        # Names of the existing tables, kept in step with every create/drop done here
+        self._known_tables = set(self.get_all_tables())
+        self._max_variables = self._variable_limit()
     
-    @contextmanager
-    def get_connection(self):
-        """Context manager for database connections"""
+    def _enable_wal(self):
+        """Switch the database file to WAL journaling so readers don't block on writers"""
         conn = sqlite3.connect(self.db_path)
         try:
-            yield conn
+            conn.execute('PRAGMA journal_mode=WAL')
         finally:
             conn.close()
     
+    def _open_connection(self, read_only: bool = False) -> sqlite3.Connection:
+        """Open a connection for the pool with the per-connection PRAGMAs applied"""
+        if read_only:
+            # WAL lets these read concurrently with the writer; mode=ro makes SQLite refuse writes
+            uri = Path(self.db_path).resolve().as_uri() + '?mode=ro'
+            conn = sqlite3.connect(uri, uri=True, check_same_thread=False, cached_statements=STATEMENT_CACHE_SIZE)
+        else:
+            conn = sqlite3.connect(self.db_path, check_same_thread=False, cached_statements=STATEMENT_CACHE_SIZE)
+        conn.executescript(CONNECTION_PRAGMAS)
+        return conn
+    
+    def _variable_limit(self) -> int:
+        """Largest number of bound parameters one statement may use on these connections"""
+        if not hasattr(sqlite3, 'SQLITE_LIMIT_VARIABLE_NUMBER'):
+            return MAX_VARIABLES_PER_STATEMENT
+        with self.get_connection() as conn:
+            return conn.getlimit(sqlite3.SQLITE_LIMIT_VARIABLE_NUMBER)
+    
+    @contextmanager
+    def get_connection(self, read_only: bool = False):
+        """Context manager that borrows a pooled connection and hands it back afterwards"""
+        pool = self._read_pool if read_only else self._pool
+        conn = pool.get()
+        try:
+            yield conn
+        finally:
+            # Never return a connection with a half-finished transaction to the pool
+            if conn.in_transaction:
+                conn.rollback()
+            pool.put(conn)
+    
+
+    def close(self):
+        """Close every pooled connection; the manager can't be used afterwards"""
+        for pool in (self._pool, self._read_pool):
+            while True:
+                try:
+                    pool.get_nowait().close()
+                except queue.Empty:
+                    break
+    
 
     @staticmethod
+    @lru_cache(maxsize=512)
     def sanitize_table_name(name: str) -> str:
-        """Sanitize table name for SQLite"""
-        # Replace special characters with underscores
-        sanitized = name.replace('[', '_').replace(']', '_').replace('-', '_')
-        # Remove any other non-alphanumeric characters except underscores
-        sanitized = ''.join(c if c.isalnum() or c == '_' else '_' for c in sanitized)
+        """Sanitize table name for SQLite (memoized, message type names recur across uploads)"""
+        # Replace special characters with underscores in a single pass
+        sanitized = name.translate(TABLE_NAME_TRANSLATION)
+        # Non-ASCII names go through str.isalnum() the slow way
+        if not sanitized.isascii():
+            sanitized = ''.join(c if c.isalnum() or c == '_' else '_' for c in sanitized)
         # Ensure it doesn't start with a number
         if sanitized and sanitized[0].isdigit():
             sanitized = "_" + sanitized
@@ -44,39 +178,62 @@ class DatabaseManager:
                 cursor = conn.cursor()
                 
                 # Get all table names
-                cursor.execute("SELECT name FROM sqlite_master WHERE type='table'")
+                cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name NOT LIKE 'sqlite_%'")
                 tables = [row[0] for row in cursor.fetchall()]
                 
-                # Drop all tables
+                # Drop all tables in one transaction, so the journal is synced once rather than per table
+                cursor.execute('BEGIN IMMEDIATE')
                 for table in tables:
                     cursor.execute(f'DROP TABLE IF EXISTS "{table}"')
-                    logger.info(f"Dropped table: {table}")
-                
                 conn.commit()
+                logger.info("Dropped %s tables", len(tables))
+                self._created_tables.clear()
+                self._known_tables.clear()
+                self._row_counts.clear()
+                self._insert_fns.clear()
+                cursor.execute('PRAGMA wal_checkpoint(PASSIVE)')
                 logger.info("All tables cleared from database")
                 
         except Exception as e:
-            logger.error(f"Error clearing tables: {str(e)}")
+            logger.error("Error clearing tables: %s", e)
             raise e
     
-    def create_table_for_message_type(self, message_type: str, message_list: Dict[str, Any], replace_existing: bool = False) -> str:
-        """Create a table for the given message type with appropriate columns"""
+    def create_table_for_message_type(self, message_type: str, message_list: Dict[str, Any], replace_existing: bool = False,
+                                      field_types: Optional[Dict[str, str]] = None) -> str:
+        """Create a table for the given message type with appropriate columns.
+
+        field_types optionally maps field names to their MAVLink types so integer and string
+        fields get INTEGER/TEXT columns; fields without a hint are stored as REAL.
+        """
         table_name = self.sanitize_table_name(message_type)
         
+        # Get all field names from messageList and the column types they map to
+        field_names = tuple(message_list.keys())
+        field_types = field_types or {}
+        shape = tuple((field, _column_affinity(field_types.get(field))) for field in field_names)
+        
+        # Already created with the same columns: keep the schema (and every connection's
+        # prepared statements) intact and only empty the table when replacing
+        if self._created_tables.get(table_name) == shape:
+            if replace_existing:
+                with self.get_connection() as conn:
+                    conn.execute(f'DELETE FROM "{table_name}"')
+                    conn.commit()
+                self._row_counts[table_name] = 0
+                logger.info("Emptied existing table: %s", table_name)
+            return table_name
+        
         with self.get_connection() as conn:
             cursor = conn.cursor()
             
             # Drop existing table if replace_existing is True
             if replace_existing:
                 cursor.execute(f'DROP TABLE IF EXISTS "{table_name}"')
-                logger.info(f"Dropped existing table: {table_name}")
+                logger.info("Dropped existing table: %s", table_name)
             
-            # Get all field names from messageList
-            field_names = list(message_list.keys())
-            
-            # Create column definitions - all as REAL for numeric data
-            columns = ['id INTEGER PRIMARY KEY AUTOINCREMENT']
-            columns.extend([f'"{field}" REAL' for field in field_names])
+            # Create column definitions - REAL unless a type hint says otherwise
+            columns = ['id INTEGER PRIMARY KEY']
+            columns.extend(_column_definition(field, affinity) for field, affinity in shape)
             
             # Create table
             create_table_sql = f'''
@@ -85,78 +242,117 @@ class DatabaseManager:
             )
             '''
             
-            logger.info(f"Creating table: {table_name}")
+            logger.info("Creating table: %s", table_name)
             cursor.execute(create_table_sql)
             conn.commit()
+            if replace_existing:
+                self._row_counts[table_name] = 0
+            else:
+                # CREATE IF NOT EXISTS may have kept an existing table with unknown contents
+                self._row_counts.pop(table_name, None)
+            self._created_tables[table_name] = shape
+            self._known_tables.add(table_name)
             
             return table_name
     
+    @staticmethod
+    def _column_values(values: Any, index_keys: List[str]) -> Iterable[Any]:
+        """Return one field's values lazily, in record order, without copying them"""
+        record_count = len(index_keys)
+        if isinstance(values, list):
+            return chain(values, repeat(None, record_count - len(values)))
+        # Typed arrays are serialized by the frontend as {"0": v0, "1": v1, ...}; when the keys
+        # are exactly that dense sequence the values are already in record order
+        if len(values) == record_count and list(values) == index_keys:
+            return values.values()
+        return map(values.get, index_keys)
+    
+    def _insert_fn(self, table_name: str, field_names: Tuple[str, ...]) -> Callable[[sqlite3.Cursor, Iterable[Tuple]], None]:
+        """Return the function that inserts rows of field_names into a table, building it once"""
+        insert_fn = self._insert_fns.get((table_name, field_names))
+        if insert_fn is not None:
+            return insert_fn
+        
+        # Bind as many rows per statement as the parameter limit allows
+        width = len(field_names)
+        rows_per_insert = max(1, min(MAX_ROWS_PER_INSERT, self._max_variables // width))
+        batch_size = rows_per_insert * width
+        batch_sql = _compile_insert(table_name, field_names, rows_per_insert)
+        
+        def insert_fn(cursor: sqlite3.Cursor, rows: Iterable[Tuple]) -> None:
+            rows = iter(rows)
+            while True:
+                # Flatten the next batch of rows into one parameter tuple at C level; sqlite3
+                # binds tuples through its fast path rather than the generic sequence protocol
+                params = tuple(chain.from_iterable(islice(rows, rows_per_insert)))
+                if len(params) == batch_size:
+                    cursor.execute(batch_sql, params)
+                elif params:
+                    # Only the final, shorter batch needs a statement of its own
+                    cursor.execute(_compile_insert(table_name, field_names, len(params) // width), params)
+                    break
+                else:
+                    break
+        
+        self._insert_fns[(table_name, field_names)] = insert_fn
+        return insert_fn
+    
     def insert_data_into_table(self, table_name: str, message_list: Dict[str, Any]) -> None:
         """Insert data into the specified table"""
-        with self.get_connection() as conn:
-            cursor = conn.cursor()
-            
-            # Get field names and their data
-            field_names = list(message_list.keys())
-            
-            # Determine the number of records (assuming all fields have the same number of entries)
-            if not field_names:
-                return
-                
-            first_field = message_list[field_names[0]]
-            if not isinstance(first_field, dict):
-                return
-                
-            record_count = len(first_field)
+        # Get field names and their data
+        field_names = tuple(message_list.keys())
+        
+        # Determine the number of records (assuming all fields have the same number of entries)
+        if not field_names:
+            return
             
-            # Prepare insert statement
-            placeholders = ', '.join(['?' for _ in field_names])
-            field_names_quoted = ', '.join([f'"{field}"' for field in field_names])
-            insert_sql = f'INSERT INTO "{table_name}" ({field_names_quoted}) VALUES ({placeholders})'
+        first_field = message_list[field_names[0]]
+        if not isinstance(first_field, (dict, list)):
+            return
             
-            # Prepare data for insertion
-            records = []
-            for i in range(record_count):
-                record = []
-                for field in field_names:
-                    value = message_list[field].get(str(i))
-                    record.append(value)
-                records.append(record)
+        record_count = len(first_field)
+        index_keys = [str(i) for i in range(record_count)]
+        
+        # Pull each field's values out column by column and transpose them into rows lazily,
+        # so only one batch of rows exists at a time
+        columns = [self._column_values(message_list[field], index_keys) for field in field_names]
+        rows = zip(*columns)
+        
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
             
-            # Insert all records
-            cursor.executemany(insert_sql, records)
+            # Insert all records in a single transaction, one multi-row INSERT per batch. IMMEDIATE
+            # takes the write lock up front instead of upgrading from a read lock mid-transaction
+            cursor.execute('BEGIN IMMEDIATE')
+            self._insert_fn(table_name, field_names)(cursor, rows)
             conn.commit()
             
-            logger.info(f"Inserted {len(records)} records into table {table_name}")
+        if table_name in self._row_counts:
+            self._row_counts[table_name] += record_count
+        logger.info("Inserted %s records into table %s", record_count, table_name)
     
     def get_all_tables(self) -> List[str]:
         """Get list of all tables in the database"""
-        with self.get_connection() as conn:
-            cursor = conn.cursor()
-            cursor.execute("SELECT name FROM sqlite_master WHERE type='table'")
-            return [row[0] for row in cursor.fetchall()]
+        with self.get_connection(read_only=True) as conn:
+            cursor = conn.execute("SELECT name FROM sqlite_master WHERE type='table' AND name NOT LIKE 'sqlite_%'")
+            return [row[0] for row in cursor]
     
-    def get_table_data(self, table_name: str, limit: int = 100) -> Tuple[List[str], List[Dict]]:
-        """Get data from a specific table"""
-        with self.get_connection() as conn:
+    def table_exists(self, table_name: str) -> bool:
+        """Check a table name against the known tables without querying the database"""
+        return table_name in self._known_tables
+    
+    def get_table_data(self, table_name: str, limit: int = 100) -> Tuple[List[str], List[Tuple]]:
+        """Get column names and rows (as tuples) from a specific table"""
+        with self.get_connection(read_only=True) as conn:
             cursor = conn.cursor()
-            cursor.execute(f'SELECT * FROM "{table_name}" LIMIT ?', (limit,))
-            rows = cursor.fetchall()
-            
-            # Get column names
-            cursor.execute(f'PRAGMA table_info("{table_name}")')
-            columns = [row[1] for row in cursor.fetchall()]
-            
-            # Convert to list of dictionaries
-            data = []
-            for row in rows:
-                data.append(dict(zip(columns, row)))
-            
-            return columns, data
+            cursor.execute(_select_sql(table_name), (limit,))
+            # Column names come with the result set, no PRAGMA round-trip needed
+            columns = [description[0] for description in cursor.description]
+            return columns, cursor.fetchall()
     
     def get_table_schema(self, table_name: str) -> List[Dict[str, Any]]:
         """Get schema information for a table"""
-        with self.get_connection() as conn:
+        with self.get_connection(read_only=True) as conn:
             cursor = conn.cursor()
             cursor.execute(f'PRAGMA table_info("{table_name}")')
             columns = cursor.fetchall()
@@ -164,28 +360,116 @@ class DatabaseManager:
     
     def get_table_row_count(self, table_name: str) -> int:
         """Get row count for a table"""
-        with self.get_connection() as conn:
+        row_count = self._row_counts.get(table_name)
+        if row_count is not None:
+            return row_count
+        
+        with self.get_connection(read_only=True) as conn:
+            return self._count_rows(conn.cursor(), table_name)
+    
+    def _count_rows(self, cursor: sqlite3.Cursor, table_name: str) -> int:
+        """Count a table's rows with a full scan.
+
+        The result is not cached: this runs on reader threads, and an insert committed between
+        the scan and the store would leave the cached count permanently behind. Counts are only
+        set by the write methods.
+        """
+        cursor.execute(f'SELECT COUNT(*) FROM "{table_name}"')
+        return cursor.fetchone()[0]
+        
+    def get_database_summary(self) -> List[Dict[str, Any]]:
+        """Get name, row count and schema for every table over a single connection"""
+        with self.get_connection(read_only=True) as conn:
             cursor = conn.cursor()
-            cursor.execute(f'SELECT COUNT(*) FROM "{table_name}"')
-            return cursor.fetchone()[0]
+            
+            # Schemas of all tables in one query via the pragma_table_info table-valued function
+            cursor.execute("""
+                SELECT m.name, p.name, p.type, p."notnull"
+                FROM sqlite_master AS m JOIN pragma_table_info(m.name) AS p
+                WHERE m.type='table' AND m.name NOT LIKE 'sqlite_%'
+                ORDER BY m.rowid, p.cid
+            """)
+            schemas = {}
+            for table_name, column, column_type, notnull in cursor.fetchall():
+                schemas.setdefault(table_name, []).append({"name": column, "type": column_type, "nullable": not notnull})
+            
+            summary = []
+            for table_name, schema in schemas.items():
+                row_count = self._row_counts.get(table_name)
+                if row_count is None:
+                    row_count = self._count_rows(cursor, table_name)
+                summary.append({"name": table_name, "row_count": row_count, "columns": schema})
+            return summary
         
     def execute_query(self, query: str) -> List[Tuple]:
         """Execute an arbitrary SQL query and return the results"""
         try:
-            # Validate that the query contains only one statement
-            if ";" in query.strip() and query.strip().count(";") > 1:
-                raise ValueError("Only single SQL statements are allowed.")
-            
-            with self.get_connection() as conn:
+            with self.get_connection(read_only=True) as conn:
                 cursor = conn.cursor()
                 
-                
-                cursor.execute(query.strip())  # Execute the sanitized query
+                # cursor.execute only runs a single statement and raises ProgrammingError for more,
+                # including a second statement after one trailing semicolon
+                cursor.execute(query.strip())
                 results = cursor.fetchall()
                 return results
         except sqlite3.Error as e:
-            logger.error(f"SQLite error executing query: {query}, Error: {str(e)}")
+            logger.error("SQLite error executing query: %s, Error: %s", query, e)
             raise e
         except Exception as e:
-            logger.error(f"Error executing query: {query}, Error: {str(e)}")
-            raise e
\ No newline at end of file
+            logger.error("Error executing query: %s, Error: %s", query, e)
+            raise e
+
+
+class AsyncDatabaseManager:
+    """Asyncio front end for DatabaseManager.
+
+    Writes run one at a time on a dedicated writer thread, reads on a pool of reader threads using
+    the read-only connections, so request handlers never block the event loop on disk I/O.
+    """
+    
+    def __init__(self, db_manager: DatabaseManager, reader_threads: int = POOL_SIZE):
+        self.db_manager = db_manager
+        self._writer_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='db-writer')
+        self._reader_executor = ThreadPoolExecutor(max_workers=reader_threads, thread_name_prefix='db-reader')
+    
+    async def run_write(self, fn: Callable, *args, **kwargs):
+        """Run a blocking function that writes to the database on the writer thread"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._writer_executor, partial(fn, *args, **kwargs))
+    
+    async def run_read(self, fn: Callable, *args, **kwargs):
+        """Run a blocking function that only reads from the database on a reader thread"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._reader_executor, partial(fn, *args, **kwargs))
+    
+    async def clear_all_tables(self):
+        """Clear all tables on the writer thread"""
+        return await self.run_write(self.db_manager.clear_all_tables)
+    
+    async def create_table_for_message_type(self, message_type: str, message_list: Dict[str, Any], replace_existing: bool = False,
+                                            field_types: Optional[Dict[str, str]] = None) -> str:
+        """Create a message type's table on the writer thread"""
+        return await self.run_write(self.db_manager.create_table_for_message_type, message_type, message_list, replace_existing,
+                                    field_types)
+    
+    async def insert_data_into_table(self, table_name: str, message_list: Dict[str, Any]) -> None:
+        """Insert a messageList on the writer thread"""
+        return await self.run_write(self.db_manager.insert_data_into_table, table_name, message_list)
+    
+    async def get_all_tables(self) -> List[str]:
+        """List all tables on a reader thread"""
+        return await self.run_read(self.db_manager.get_all_tables)
+    
+    async def get_table_data(self, table_name: str, limit: int = 100) -> Tuple[List[str], List[Tuple]]:
+        """Read rows from a table on a reader thread"""
+        return await self.run_read(self.db_manager.get_table_data, table_name, limit)
+    
+    def table_exists(self, table_name: str) -> bool:
+        """Check a table name against the known tables (no I/O)"""
+        return self.db_manager.table_exists(table_name)
+    
+    def close(self):
+        """Wait for queued work, then close the executors and the pooled connections"""
+        self._writer_executor.shutdown()
+        self._reader_executor.shutdown()
+        self.db_manager.close()